@@ -0,0 +1,86 @@
+"""
+Cache Helper Functions
+
+Redis read-through cache helpers for hot, rarely-changing reads.
+Caching is skipped when REDIS_URL is not set or Redis is unreachable.
+"""
+
+import os
+import secrets
+import orjson
+from dotenv import load_dotenv
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+# Load environment variables from .env file
+load_dotenv()
+
+_redis = None
+
+redis_url = os.getenv("REDIS_URL")
+
+# Connection lifecycle (call from the app's lifespan alongside the database)
+def connect_cache():
+    """Create the Redis client if REDIS_URL is configured"""
+    global _redis
+    if _redis is None and redis_url:
+        _redis = Redis.from_url(redis_url)
+    return _redis
+
+async def close_cache():
+    """Close the Redis client"""
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+    _redis = None
+
+# Helper functions for cached reads
+async def cache_get(key: str):
+    """Return the decoded cached value, or None on miss"""
+    if _redis is None:
+        return None
+    try:
+        cached = await _redis.get(key)
+    except RedisError:
+        return None
+    return orjson.loads(cached) if cached is not None else None
+
+async def cache_set(key: str, value, ttl: int = 60):
+    """Store a JSON-serializable value with a TTL in seconds"""
+    if _redis is None:
+        return
+    try:
+        await _redis.set(key, orjson.dumps(value), ex=ttl)
+    except RedisError:
+        pass
+
+# Collection versions: a random token replaced on every write and used in ETags and list cache keys.
+# Random (not INCR) so a flush, restart or eviction can never bring back a previously issued tag.
+# Tokens expire so a bump lost to a Redis error only keeps an old tag valid for a bounded time.
+VERSION_TTL = 300
+
+def _version_key(collection_name: str) -> str:
+    return f"version:{collection_name}"
+
+async def get_version(collection_name: str):
+    """Current version token of a collection, or None when the cache is unavailable"""
+    if _redis is None:
+        return None
+    key = _version_key(collection_name)
+    try:
+        version = await _redis.get(key)
+        if version is None:
+            await _redis.set(key, secrets.token_hex(8), nx=True, ex=VERSION_TTL)
+            version = await _redis.get(key)
+    except RedisError:
+        return None
+    return version.decode() if version is not None else None
+
+async def bump_version(collection_name: str):
+    """Mark a collection as changed"""
+    if _redis is None:
+        return
+    try:
+        await _redis.set(_version_key(collection_name), secrets.token_hex(8), ex=VERSION_TTL)
+    except RedisError:
+        pass
@@ -5,51 +5,128 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime, timezone
+import logging
 import os
 from dotenv import load_dotenv
-from typing import Union
+from typing import List, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 _client = None
 db = None
 
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
-if database_url and database_name:
-    _client = MongoClient(database_url)
-    db = _client[database_name]
+# Connection pool sizing, per worker process: keep WEB_CONCURRENCY x MONGO_MAX_POOL under the server's connection limit
+mongo_max_pool = int(os.getenv("MONGO_MAX_POOL", "200"))
+mongo_min_pool = int(os.getenv("MONGO_MIN_POOL", "20"))
 
-# Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
-    """Insert a single document with timestamp"""
+# Cursor batch sizes: list reads fit typical results in one round-trip; streams start producing bytes sooner
+LIST_BATCH_SIZE = 500
+STREAM_BATCH_SIZE = 100
+
+# Connection lifecycle (call from the app's lifespan so the pool is ready before the first request)
+def connect_db():
+    """Create the Motor client and bind the database handle"""
+    global _client, db
+    if _client is None and database_url and database_name:
+        _client = AsyncIOMotorClient(
+            database_url,
+            maxPoolSize=mongo_max_pool,
+            minPoolSize=mongo_min_pool,
+            serverSelectionTimeoutMS=2000,
+            socketTimeoutMS=5000,
+        )
+        db = _client[database_name]
+    return db
+
+def close_db():
+    """Close the Motor client and release pooled connections"""
+    global _client, db
+    if _client is not None:
+        _client.close()
+    _client = None
+    db = None
+
+async def ensure_indexes():
+    """Create the indexes used by the API's filters and joins; failures are logged, not raised"""
+    if not (database_url and database_name):
+        return
+    # Dedicated client without the pool's socketTimeoutMS: builds on large collections can outlast a request
+    index_client = AsyncIOMotorClient(database_url, serverSelectionTimeoutMS=2000)
+    try:
+        loan = index_client[database_name].loan
+        await loan.create_index("status")
+        await loan.create_index("customer_id")
+        await loan.create_index("partner_id")
+        await loan.create_index([("status", 1), ("application_date", -1)])
+    except Exception:
+        logger.exception("Index creation failed; the API will run without them")
+    finally:
+        index_client.close()
+
+def get_db():
+    """Return the active database handle"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
+    return db
 
-    # Convert Pydantic model to dict if needed
+# Helper functions for common database operations
+def _as_document(data: Union[BaseModel, dict], already_dumped: bool) -> dict:
+    # Convert Pydantic model to dict if needed; pre-dumped dicts are owned by the caller and used in place
     if isinstance(data, BaseModel):
-        data_dict = data.model_dump()
-    else:
-        data_dict = data.copy()
+        return data.model_dump()
+    return data if already_dumped else data.copy()
+
+async def create_document(collection_name: str, data: Union[BaseModel, dict], already_dumped: bool = False):
+    """Insert a single document with timestamp"""
+    database = get_db()
 
-    data_dict['created_at'] = datetime.now(timezone.utc)
-    data_dict['updated_at'] = datetime.now(timezone.utc)
+    data_dict = _as_document(data, already_dumped)
 
-    result = db[collection_name].insert_one(data_dict)
+    now = datetime.now(timezone.utc)
+    data_dict['created_at'] = now
+    data_dict['updated_at'] = now
+
+    result = await database[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+async def create_documents(collection_name: str, items: List[Union[BaseModel, dict]], already_dumped: bool = False):
+    """Insert many documents with timestamps in a single unordered bulk write"""
+    database = get_db()
+
+    now = datetime.now(timezone.utc)
+    docs = []
+    for data in items:
+        data_dict = _as_document(data, already_dumped)
+        data_dict['created_at'] = now
+        data_dict['updated_at'] = now
+        docs.append(data_dict)
+
+    if not docs:
+        return []
+    result = await database[collection_name].insert_many(docs, ordered=False)
+    return [str(inserted_id) for inserted_id in result.inserted_ids]
+
+async def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None, projection: dict = None):
     """Get documents from collection"""
-    if db is None:
-        raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
-    
-    cursor = db[collection_name].find(filter_dict or {})
+    database = get_db()
+
+    cursor = database[collection_name].find(filter_dict or {}, projection).batch_size(LIST_BATCH_SIZE)
     if limit:
         cursor = cursor.limit(limit)
-    
-    return list(cursor)
+
+    return await cursor.to_list(length=None)
+
+def stream_aggregate(collection_name: str, pipeline: list, batch_size: int = STREAM_BATCH_SIZE):
+    """Return an async cursor over an aggregation pipeline for incremental iteration"""
+    database = get_db()
+
+    return database[collection_name].aggregate(pipeline, batchSize=batch_size)
@@ -1,39 +1,146 @@
+import asyncio
 import os
-from datetime import datetime
-from typing import List, Optional
-from fastapi import FastAPI, HTTPException
+import orjson
+from contextlib import asynccontextmanager, suppress
+from datetime import date, datetime, time, timezone
+from typing import Annotated, List, Optional
+from fastapi import APIRouter, Body, FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from bson import ObjectId
 
-from database import db, create_document, get_documents
+import database
+from database import connect_db, close_db, ensure_indexes, get_db, create_document, create_documents, get_documents, stream_aggregate
+from cache import connect_cache, close_cache, cache_get, cache_set, get_version, bump_version
 from schemas import Customer as CustomerSchema, Partner as PartnerSchema, Loan as LoanSchema
 
-app = FastAPI(title="Loan Tracker API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    connect_db()
+    connect_cache()
+    # Build indexes in the background so a slow or unreachable database doesn't block serving (/test reports it)
+    index_task = asyncio.create_task(ensure_indexes())
+    yield
+    index_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await index_task
+    await close_cache()
+    close_db()
+
+class MongoJSONResponse(ORJSONResponse):
+    """ORJSONResponse that also encodes ObjectId values (datetimes are native to orjson)"""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_orjson_default, option=orjson.OPT_NON_STR_KEYS)
+
+def _orjson_default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+async def first_document(cursor):
+    """Fetch the first document before streaming, so query errors surface as a 500 instead of a truncated 200"""
+    try:
+        return await cursor.next()
+    except StopAsyncIteration:
+        return None
+
+async def stream_json(first, cursor, ndjson: bool = False):
+    """Encode the prefetched first document and the rest of the cursor as they arrive (NDJSON lines or a JSON array)"""
+    if first is None:
+        if not ndjson:
+            yield b"[]"
+        return
+    if ndjson:
+        yield orjson.dumps(first, default=_orjson_default) + b"\n"
+        async for doc in cursor:
+            yield orjson.dumps(doc, default=_orjson_default) + b"\n"
+        return
+    yield b"[" + orjson.dumps(first, default=_orjson_default)
+    async for doc in cursor:
+        yield b"," + orjson.dumps(doc, default=_orjson_default)
+    yield b"]"
+
+app = FastAPI(title="Loan Tracker API", lifespan=lifespan, default_response_class=MongoJSONResponse)
+
+# Comma-separated list of allowed origins; an explicit list lets production skip wildcard handling
+cors_origins = [origin.strip() for origin in os.getenv("CORS_ORIGINS", "*").split(",") if origin.strip()]
 
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=cors_origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
-# Utility: convert Mongo documents to JSON-safe
+# Cache keys for list endpoints; suffixed with the collection version so a create retires the entry
+CUSTOMERS_CACHE_KEY = "customers:all"
+PARTNERS_CACHE_KEY = "partners:all"
+LIST_CACHE_TTL = 60
+
+# Conditional GET: weak ETags from per-collection version counters (bumped on every create)
+
+def list_etag(collection_name: str, version: Optional[str], variant: str = ""):
+    if version is None:
+        return None
+    return f'W/"{collection_name}{variant}:{version}"'
 
-def serialize_doc(doc):
-    if not doc:
-        return doc
-    doc["id"] = str(doc.pop("_id"))
-    # Convert datetime to isoformat
-    for k, v in list(doc.items()):
-        if isinstance(v, datetime):
-            doc[k] = v.isoformat()
-    return doc
+def etag_matches(etag: Optional[str], if_none_match: Optional[str]) -> bool:
+    if not etag or not if_none_match:
+        return False
+    return if_none_match.strip() == "*" or etag in [tag.strip() for tag in if_none_match.split(",")]
+
+def etag_headers(etag: Optional[str]) -> Optional[dict]:
+    return {"ETag": etag} if etag else None
+
+async def cached_list(collection_name: str, cache_key: str, projection: dict, if_none_match: Optional[str]):
+    """List a collection with ETag revalidation and a Redis cache entry scoped to the current version"""
+    # Version is read before the query: a racing create can only make the body newer than its tag, never older
+    version = await get_version(collection_name)
+    etag = list_etag(collection_name, version)
+    if etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers=etag_headers(etag))
+    if version is None:
+        return MongoJSONResponse(await get_documents(collection_name, projection=projection))
+    versioned_key = f"{cache_key}:{version}"
+    cached = await cache_get(versioned_key)
+    if cached is not None:
+        return MongoJSONResponse(cached, headers=etag_headers(etag))
+    docs = await get_documents(collection_name, projection=projection)
+    await cache_set(versioned_key, docs, ttl=LIST_CACHE_TTL)
+    return MongoJSONResponse(docs, headers=etag_headers(etag))
+
+# Upper bound on bulk create payloads (keeps a single insert_many well under the 16MB BSON limit);
+# enforced on the body type so oversized lists are rejected during validation
+MAX_BULK_ITEMS = 1000
+
+# Utility: Mongo projection exposing _id as a string "id" so documents need no Python-side rewriting
+
+def output_fields(schema):
+    fields = {name: 1 for name in schema.model_fields}
+    fields.update({"_id": 0, "id": {"$toString": "$_id"}, "created_at": 1, "updated_at": 1})
+    return fields
+
+CUSTOMER_FIELDS = output_fields(CustomerSchema)
+PARTNER_FIELDS = output_fields(PartnerSchema)
+LOAN_FIELDS = output_fields(LoanSchema)
+
+
+# Response models: document the API shape. List endpoints return pre-shaped documents
+# (see output_fields) directly, so FastAPI does not re-validate rows on the hot path.
+
+class DocumentOut(BaseModel):
+    id: str
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
 
 
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Loan Tracker Backend Ready"}
 
 
@@ -41,91 +148,231 @@ def read_root():
 # Customers
 # =============================
 
+customers_router = APIRouter(prefix="/api/customers", tags=["customers"])
+
 class CustomerCreate(CustomerSchema):
     pass
 
-@app.post("/api/customers")
-def create_customer(payload: CustomerCreate):
-    customer_id = create_document("customer", payload)
+class CustomerOut(CustomerSchema, DocumentOut):
+    pass
+
+@customers_router.post("")
+async def create_customer(payload: CustomerCreate):
+    customer_id = await create_document("customer", payload)
+    await bump_version("customer")
     return {"id": customer_id}
 
-@app.get("/api/customers")
-def list_customers():
-    docs = get_documents("customer")
-    return [serialize_doc(d) for d in docs]
+@customers_router.post("/bulk")
+async def bulk_create_customers(payload: Annotated[List[CustomerCreate], Body(max_length=MAX_BULK_ITEMS)]):
+    if not payload:
+        return {"ids": []}
+    ids = await create_documents("customer", payload)
+    await bump_version("customer")
+    return {"ids": ids}
+
+@customers_router.get("", response_model=List[CustomerOut])
+async def list_customers(if_none_match: Optional[str] = Header(None)):
+    return await cached_list("customer", CUSTOMERS_CACHE_KEY, CUSTOMER_FIELDS, if_none_match)
 
 
 # =============================
 # Partners
 # =============================
 
+partners_router = APIRouter(prefix="/api/partners", tags=["partners"])
+
 class PartnerCreate(PartnerSchema):
     pass
 
-@app.post("/api/partners")
-def create_partner(payload: PartnerCreate):
-    partner_id = create_document("partner", payload)
+class PartnerOut(PartnerSchema, DocumentOut):
+    pass
+
+@partners_router.post("")
+async def create_partner(payload: PartnerCreate):
+    partner_id = await create_document("partner", payload)
+    await bump_version("partner")
     return {"id": partner_id}
 
-@app.get("/api/partners")
-def list_partners():
-    docs = get_documents("partner")
-    return [serialize_doc(d) for d in docs]
+@partners_router.post("/bulk")
+async def bulk_create_partners(payload: Annotated[List[PartnerCreate], Body(max_length=MAX_BULK_ITEMS)]):
+    if not payload:
+        return {"ids": []}
+    ids = await create_documents("partner", payload)
+    await bump_version("partner")
+    return {"ids": ids}
+
+@partners_router.get("", response_model=List[PartnerOut])
+async def list_partners(if_none_match: Optional[str] = Header(None)):
+    return await cached_list("partner", PARTNERS_CACHE_KEY, PARTNER_FIELDS, if_none_match)
 
 
 # =============================
 # Loans
 # =============================
 
+loans_router = APIRouter(prefix="/api/loans", tags=["loans"])
+
 class LoanCreate(LoanSchema):
     pass
 
-@app.post("/api/loans")
-def create_loan(payload: LoanCreate):
-    # Basic referential checks
-    if payload.customer_id:
-        try:
-            customer = db.customer.find_one({"_id": ObjectId(payload.customer_id)})
-            if not customer:
-                raise HTTPException(status_code=400, detail="Invalid customer_id")
-        except Exception:
-            raise HTTPException(status_code=400, detail="Invalid customer_id format")
-    if payload.partner_id:
-        try:
-            partner = db.partner.find_one({"_id": ObjectId(payload.partner_id)})
-            if not partner:
-                raise HTTPException(status_code=400, detail="Invalid partner_id")
-        except Exception:
-            raise HTTPException(status_code=400, detail="Invalid partner_id format")
-
-    # Compute commission if funded and commission not set
-    data = payload.model_dump()
+class LoanOut(LoanSchema, DocumentOut):
+    # Stored as UTC-midnight datetimes (see dates_to_datetimes), so they are returned as datetimes
+    application_date: Optional[datetime] = None
+    funded_date: Optional[datetime] = None
+    customer_name: Optional[str] = None
+    partner_name: Optional[str] = None
+
+PARTNER_RATE_TTL = 300
+
+def parse_object_id(value: Optional[str], field: str) -> Optional[ObjectId]:
+    """Parse a reference id once, rejecting malformed values without a DB round-trip"""
+    if not value:
+        return None
+    if not ObjectId.is_valid(value):
+        raise HTTPException(status_code=400, detail=f"Invalid {field} format")
+    return ObjectId(value)
+
+def partner_rate_key(partner_oid: ObjectId) -> str:
+    return f"partner:{partner_oid}:commission_rate"
+
+async def get_partner_rate(partner_oid: Optional[ObjectId]):
+    """Commission rate for a partner, or None if the partner does not exist"""
+    if partner_oid is None:
+        return None
+    key = partner_rate_key(partner_oid)
+    cached = await cache_get(key)
+    if cached is not None:
+        return cached
+    partner = await get_db().partner.find_one({"_id": partner_oid}, {"commission_rate": 1})
+    if not partner:
+        return None
+    rate = float(partner.get("commission_rate") or 0.0)
+    await cache_set(key, rate, ttl=PARTNER_RATE_TTL)
+    return rate
+
+LOAN_DATE_FIELDS = ("application_date", "funded_date")
+
+def dates_to_datetimes(data: dict) -> dict:
+    """BSON has no date-only type: store loan dates as UTC midnight datetimes"""
+    for field in LOAN_DATE_FIELDS:
+        value = data.get(field)
+        if type(value) is date:
+            data[field] = datetime.combine(value, time.min, tzinfo=timezone.utc)
+    return data
+
+def apply_commission(data: dict, partner_rate: Optional[float]) -> dict:
+    """Compute commission if funded and commission not set"""
     if data.get("status") == "funded":
-        # fetch partner rate
-        rate = 0.0
-        if data.get("partner_id"):
-            p = db.partner.find_one({"_id": ObjectId(data["partner_id"])})
-            if p and "commission_rate" in p:
-                rate = float(p["commission_rate"]) or 0.0
+        rate = partner_rate or 0.0
         commission = round((data["amount"] * rate) / 100.0, 2)
         data["commission_amount"] = commission
         if not data.get("funded_date"):
-            data["funded_date"] = datetime.utcnow().date()
+            data["funded_date"] = datetime.combine(datetime.now(timezone.utc).date(), time.min, tzinfo=timezone.utc)
+    return data
+
+async def _customer_exists(customer_oid: Optional[ObjectId]) -> bool:
+    if customer_oid is None:
+        return False
+    return bool(await get_db().customer.count_documents({"_id": customer_oid}, limit=1))
+
+@loans_router.post("")
+async def create_loan(payload: LoanCreate):
+    # Basic referential checks (format first, then both lookups concurrently)
+    customer_oid = parse_object_id(payload.customer_id, "customer_id")
+    partner_oid = parse_object_id(payload.partner_id, "partner_id")
+    customer_exists, partner_rate = await asyncio.gather(
+        _customer_exists(customer_oid),
+        get_partner_rate(partner_oid),
+    )
+    if customer_oid is not None and not customer_exists:
+        raise HTTPException(status_code=400, detail="Invalid customer_id")
+    if partner_oid is not None and partner_rate is None:
+        raise HTTPException(status_code=400, detail="Invalid partner_id")
 
-    loan_id = create_document("loan", data)
+    data = apply_commission(dates_to_datetimes(payload.model_dump(exclude_none=True)), partner_rate)
+    # Store references as ObjectId so joins and indexes need no conversion
+    if customer_oid is not None:
+        data["customer_id"] = customer_oid
+    if partner_oid is not None:
+        data["partner_id"] = partner_oid
+    loan_id = await create_document("loan", data, already_dumped=True)
+    await bump_version("loan")
     return {"id": loan_id}
 
-@app.get("/api/loans")
-def list_loans(status: Optional[str] = None):
-    filt = {"status": status} if status else None
-    docs = get_documents("loan", filt)
-    # Enrich with customer and partner names if available
-    enriched = []
-    for d in docs:
-        cust = db.customer.find_one({"_id": d.get("customer_id")}) if isinstance(d.get("customer_id"), ObjectId) else None
-        part = db.partner.find_one({"_id": d.get("partner_id")}) if isinstance(d.get("partner_id"), ObjectId) else None
-        enriched.append(serialize_doc(d))
-    return enriched
+@loans_router.post("/bulk")
+async def bulk_create_loans(payload: Annotated[List[LoanCreate], Body(max_length=MAX_BULK_ITEMS)]):
+    if not payload:
+        return {"ids": []}
+    db = get_db()
+    # Parse every reference once, then check the whole batch with one $in query per collection
+    customer_oids = {p.customer_id: parse_object_id(p.customer_id, "customer_id") for p in payload if p.customer_id}
+    partner_oids = {p.partner_id: parse_object_id(p.partner_id, "partner_id") for p in payload if p.partner_id}
+    customer_docs, partner_docs = await asyncio.gather(
+        db.customer.find({"_id": {"$in": list(set(customer_oids.values()))}}, {"_id": 1}).to_list(length=None),
+        db.partner.find({"_id": {"$in": list(set(partner_oids.values()))}}, {"commission_rate": 1}).to_list(length=None),
+    )
+    found_customers = {c["_id"] for c in customer_docs}
+    rates = {p["_id"]: float(p.get("commission_rate") or 0.0) for p in partner_docs}
+    for raw, oid in customer_oids.items():
+        if oid not in found_customers:
+            raise HTTPException(status_code=400, detail=f"Invalid customer_id: {raw}")
+    for raw, oid in partner_oids.items():
+        if oid not in rates:
+            raise HTTPException(status_code=400, detail=f"Invalid partner_id: {raw}")
+
+    docs = []
+    for p in payload:
+        partner_oid = partner_oids.get(p.partner_id)
+        data = apply_commission(dates_to_datetimes(p.model_dump(exclude_none=True)), rates.get(partner_oid))
+        if p.customer_id:
+            data["customer_id"] = customer_oids[p.customer_id]
+        if partner_oid is not None:
+            data["partner_id"] = partner_oid
+        docs.append(data)
+    ids = await create_documents("loan", docs, already_dumped=True)
+    await bump_version("loan")
+    return {"ids": ids}
+
+def _to_oid(field):
+    # Older loans store references as strings; normalise server-side for $lookup
+    return {"$convert": {"input": f"${field}", "to": "objectId", "onError": None, "onNull": None}}
+
+@loans_router.get("", response_model=List[LoanOut])
+async def list_loans(
+    status: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    if_none_match: Optional[str] = Header(None),
+):
+    ndjson = NDJSON_MEDIA_TYPE in (accept or "")
+    # Customers/partners are insert-only, so embedded names cannot change under an unchanged loan version
+    etag = list_etag("loan", await get_version("loan"), variant=".ndjson" if ndjson else "")
+    if etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers={"Vary": "Accept", **(etag_headers(etag) or {})})
+    pipeline = [
+        {"$match": {"status": status} if status else {}},
+        {"$addFields": {"_customer_oid": _to_oid("customer_id"), "_partner_oid": _to_oid("partner_id")}},
+        {"$lookup": {"from": "customer", "localField": "_customer_oid", "foreignField": "_id", "as": "cust"}},
+        {"$lookup": {"from": "partner", "localField": "_partner_oid", "foreignField": "_id", "as": "part"}},
+        {"$project": {
+            **LOAN_FIELDS,
+            "customer_name": {"$concat": [
+                {"$arrayElemAt": ["$cust.first_name", 0]}, " ", {"$arrayElemAt": ["$cust.last_name", 0]},
+            ]},
+            "partner_name": {"$arrayElemAt": ["$part.name", 0]},
+        }},
+    ]
+    cursor = stream_aggregate("loan", pipeline)
+    first = await first_document(cursor)
+    return StreamingResponse(
+        stream_json(first, cursor, ndjson=ndjson),
+        media_type=NDJSON_MEDIA_TYPE if ndjson else "application/json",
+        headers={"Vary": "Accept", **(etag_headers(etag) or {})},
+    )
+
+
+app.include_router(customers_router)
+app.include_router(partners_router)
+app.include_router(loans_router)
 
 
 # =============================
@@ -133,7 +380,7 @@ def list_loans(status: Optional[str] = None):
 # =============================
 
 @app.get("/test")
-def test_database():
+async def test_database():
     """Test endpoint to check if database is available and accessible"""
     response = {
         "backend": "✅ Running",
@@ -144,13 +391,14 @@ def test_database():
         "collections": []
     }
     try:
+        db = database.db
         if db is not None:
             response["database"] = "✅ Available"
             response["database_url"] = "✅ Configured"
             response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await db.list_collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -169,4 +417,6 @@ def test_database():
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+    # Import string (not the app object) so uvicorn can spawn workers; each builds its own clients in lifespan
+    uvicorn.run("main:app", host="0.0.0.0", port=port, loop="uvloop", http="httptools", workers=workers)
@@ -49,8 +49,10 @@ class Loan(BaseModel):
     Loans collection schema
     Collection name: "loan"
     """
-    customer_id: str = Field(..., description="Reference to customer _id as string")
-    partner_id: Optional[str] = Field(None, description="Reference to referral partner _id as string")
+    # Accepted as hex strings; new loans store them as ObjectId, older ones as strings,
+    # so equality filters on these fields must match both types (e.g. {"$in": [oid, str(oid)]})
+    customer_id: str = Field(..., description="Reference to customer _id (hex string; stored as ObjectId)")
+    partner_id: Optional[str] = Field(None, description="Reference to referral partner _id (hex string; stored as ObjectId)")
     amount: float = Field(..., gt=0, description="Loan principal amount")
     status: Literal["applied", "approved", "funded", "rejected", "closed"] = Field("applied", description="Current loan status")
     application_date: Optional[date] = Field(None, description="Date the application was submitted")